@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from bs4 import BeautifulSoup
+import click
 from collections import defaultdict
 import datetime
 from dotenv import find_dotenv, load_dotenv
@@ -10,6 +11,11 @@ from pathlib import Path
 import requests
 from typing import List, Literal, Optional
 
+from src.data.recrawl import RatingScheduler, get_scheduler
+from src.data.tag_index import update_tag_index
+from src.data.tag_rollup import load_rollup
+from src.instrumentation import METRICS
+
 
 class Post():
     """
@@ -107,6 +113,17 @@ class Post():
         if author_name != "/404":
             self.author_name = author_name[2:]
 
+    def update_rating(self):
+        """Download the current rating of an already downloaded post"""
+        with METRICS.timer("http_request"):
+            html = requests.get(self.url, headers=Contents.DEFAULT_HEADERS)
+        METRICS.inc("http_requests")
+        METRICS.inc("bytes_fetched", len(html.content))
+        parsed_html = BeautifulSoup(html.text, "html.parser")
+        article = parsed_html.find("article")
+        if article:
+            self.get_rating(article)
+
     def get_author_rating(self):
         if not self.author_name:
             return
@@ -171,15 +188,21 @@ class Contents():
         page_number = 1
         condition = True
         while condition:
-            html = requests.get(self.url + "page=" + str(page_number),
-                                headers=Contents.DEFAULT_HEADERS)
-            parsed_html = BeautifulSoup(html.text, "html.parser")
-            posts_html = parsed_html.findAll("article")
-
-            for post_html in posts_html[:-1]:
-                post = Post()
-                post.get_data(post_html)
-                self.posts.append(post)
+            with METRICS.timer("http_request"):
+                html = requests.get(self.url + "page=" + str(page_number),
+                                    headers=Contents.DEFAULT_HEADERS)
+            METRICS.inc("http_requests")
+            METRICS.inc("bytes_fetched", len(html.content))
+
+            with METRICS.timer("html_parse"):
+                parsed_html = BeautifulSoup(html.text, "html.parser")
+                posts_html = parsed_html.findAll("article")
+
+                for post_html in posts_html[:-1]:
+                    post = Post()
+                    post.get_data(post_html)
+                    self.posts.append(post)
+            METRICS.inc("articles_parsed", len(posts_html[:-1]))
 
             condition = len(posts_html[:-1]) > 0 and (page_count == -1 or page_number < page_count)
             page_number += 1
@@ -201,29 +224,105 @@ def daterange(start_date: datetime.date, end_date: datetime.date):
 
 
 def main(output_dir_path: str,
+         interim_dir_path: str,
          start_date: datetime.date,
          end_date: datetime.date):
-    """Download data from the website and put it to /data/raw"""
+    """
+    Download data from the website, put it to /data/raw and update
+    the aggregates in /data/interim
+    """
 
     FILENAME = "posts_{}.csv"
 
     logger.info("downloading data...")
+    rollup = load_rollup(output_dir_path,
+                         os.path.join(interim_dir_path, "tag_counts.csv"))
+    scheduler = get_scheduler(interim_dir_path)
+    tag_index_path = os.path.join(interim_dir_path, "tag_index.pkl")
+    tag_index = update_tag_index(output_dir_path, tag_index_path)
 
     for cur_date in daterange(start_date, end_date):
         #try:
             contents = Contents("search", cur_date)
-            contents.download_posts()
-            contents.create_dataframe(exclude=["author_rating"])
-            contents.data.drop_duplicates(subset=["url"], inplace=True)
-            contents.data.to_csv(output_dir_path + FILENAME.format(cur_date),
-                                 encoding='utf-8',
-                                 index=False)
+            with METRICS.stage("download", str(cur_date)):
+                contents.download_posts()
+            with METRICS.stage("write_csv", str(cur_date)):
+                contents.create_dataframe(exclude=["author_rating"])
+                contents.data.drop_duplicates(subset=["url"], inplace=True)
+                contents.data.to_csv(os.path.join(output_dir_path,
+                                                  FILENAME.format(cur_date)),
+                                     encoding='utf-8',
+                                     index=False)
+            METRICS.inc("rows_written", len(contents.data))
+
+            with METRICS.stage("update_aggregates", str(cur_date)):
+                rollup.update_day(cur_date, contents.data["tags"])
+                rollup.save()
+                scheduler.register(contents.data)
+                scheduler.save()
+                tag_index.add_day(cur_date, contents.data)
+                tag_index.save(tag_index_path)
 
         #    logger.info("successfully downloaded data for " + str(cur_date))
         #except Exception:
         #    logger.error("failed to download data for " + str(cur_date))
 
-    logger.info("data downloading finished")
+    logger.info("data downloading finished, %s articles/sec parsed",
+                METRICS.rate("articles_parsed", "html_parse"))
+
+
+def recrawl_ratings(scheduler: RatingScheduler, budget: Optional[int] = None):
+    """Re-download ratings of the posts whose ratings are still moving"""
+    SAVE_EVERY = 100
+
+    urls = scheduler.due(budget=budget)
+    logger.info("re-crawling ratings of %d posts", len(urls))
+    with METRICS.stage("recrawl"):
+        try:
+            for i, url in enumerate(urls, 1):
+                post = Post(url=url)
+                try:
+                    post.update_rating()
+                    rating = int(post.rating) if post.rating is not None \
+                        else None
+                except (requests.RequestException, ValueError):
+                    logger.warning("failed to re-crawl " + url)
+                    rating = None
+                if rating is None:
+                    METRICS.inc("recrawl_failures")
+                    scheduler.observe_failure(url)
+                else:
+                    scheduler.observe(url, rating)
+                if i % SAVE_EVERY == 0:
+                    scheduler.save()
+        finally:
+            scheduler.save()
+
+
+@click.command()
+@click.option("--profile", is_flag=True,
+              help="Dump cProfile and tracemalloc snapshots per stage")
+@click.option("--recrawl", "recrawl_budget", default=None, type=int,
+              help="Only re-crawl ratings of at most this many moving posts")
+def cli(profile, recrawl_budget):
+    project_dir = Path(__file__).resolve().parents[2]
+    dirname = os.path.join(project_dir, os.path.join("data", "raw"))
+    interim_dirname = os.path.join(project_dir, "data", "interim")
+    os.makedirs(interim_dirname, exist_ok=True)
+    reports_dir = os.path.join(project_dir, "reports")
+
+    if profile:
+        METRICS.enable_profiling(os.path.join(reports_dir, "profile",
+                                              "download_data"))
+
+    if recrawl_budget is not None:
+        recrawl_ratings(get_scheduler(interim_dirname), recrawl_budget)
+    else:
+        main(dirname, interim_dirname,
+             datetime.date(2019, 11, 2), datetime.date(2019, 11, 3))
+
+    METRICS.log_summary()
+    METRICS.write_textfile(os.path.join(reports_dir, "download_data.prom"))
 
 
 if __name__ == "__main__":
@@ -233,7 +332,4 @@ if __name__ == "__main__":
 
     load_dotenv(find_dotenv())
 
-    project_dir = Path(__file__).resolve().parents[2]
-    dirname = os.path.join(project_dir, os.path.join("data", "raw"))
-
-    main(dirname, datetime.date(2019, 11, 2), datetime.date(2019, 11, 3))
+    cli()
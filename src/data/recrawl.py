@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import os
+import pandas as pd
+from typing import Optional
+
+
+class RatingScheduler():
+    """
+    This class schedules rating re-crawls of already downloaded posts.
+    For every post it keeps the age, the last observed rating and the time
+    of the next check. A post is checked again sooner while its rating is
+    moving and backs off exponentially once it stops changing; it is
+    settled after a few unchanged checks or when it gets older than
+    MAX_AGE. Only non-zero rating changes are stored, as a time series
+    of deltas keyed by url.
+    """
+
+    MIN_INTERVAL = pd.Timedelta(hours=1)
+    MAX_AGE = pd.Timedelta(days=7)
+    SETTLED_CHECKS = 3
+    # changes below this share of the rating count as "not moving"
+    RELATIVE_TOLERANCE = 0.01
+
+    STATE_COLUMNS = ["url", "publ_time", "base_rating", "last_rating",
+                     "last_checked", "next_check", "unchanged_checks"]
+    DELTA_COLUMNS = ["url", "checked_at", "delta"]
+
+    def __init__(self, state_path: str, deltas_path: str):
+        self.state_path = state_path
+        self.deltas_path = deltas_path
+        if os.path.exists(state_path):
+            self.state = pd.read_csv(state_path, index_col="url")
+            for column in ["publ_time", "last_checked", "next_check"]:
+                self.state[column] = pd.to_datetime(self.state[column],
+                                                    utc=True)
+        else:
+            self.state = RatingScheduler._empty_state()
+        self.new_deltas = []
+
+    @staticmethod
+    def _empty_state() -> pd.DataFrame:
+        # typed columns, so that concat keeps tz-aware timestamps
+        return pd.DataFrame({
+            "publ_time": pd.Series(dtype="datetime64[ns, UTC]"),
+            "base_rating": pd.Series(dtype="int64"),
+            "last_rating": pd.Series(dtype="int64"),
+            "last_checked": pd.Series(dtype="datetime64[ns, UTC]"),
+            "next_check": pd.Series(dtype="datetime64[ns, UTC]"),
+            "unchanged_checks": pd.Series(dtype="int64"),
+        }, index=pd.Index([], dtype=object, name="url"))
+
+    def register(self, df: pd.DataFrame,
+                 crawled_at: Optional[pd.Timestamp] = None):
+        """Start tracking freshly crawled posts"""
+        crawled_at = crawled_at or pd.Timestamp.now(tz="UTC")
+        df = df[df["url"].astype(bool) & df["rating"].notna()]
+        df = df[~df["url"].isin(self.state.index)].drop_duplicates("url")
+        urls = pd.Index(df["url"].to_numpy(), name="url")
+        # all series share the url index, so tz-aware dtypes are kept
+        publ_time = pd.to_datetime(df["publ_time"], utc=True).set_axis(urls)
+        rating = df["rating"].astype(int).set_axis(urls)
+        next_check = pd.Series(crawled_at + RatingScheduler.MIN_INTERVAL,
+                               index=urls)
+        next_check[crawled_at - publ_time > RatingScheduler.MAX_AGE] = pd.NaT
+        new = pd.DataFrame({"publ_time": publ_time,
+                            "base_rating": rating,
+                            "last_rating": rating,
+                            "last_checked": pd.Series(crawled_at, index=urls),
+                            "next_check": next_check,
+                            "unchanged_checks": 0},
+                           index=urls)
+        self.state = pd.concat([self.state, new])
+
+    def due(self, now: Optional[pd.Timestamp] = None,
+            budget: Optional[int] = None) -> pd.Index:
+        """Urls that should be checked now, the most overdue first"""
+        now = now or pd.Timestamp.now(tz="UTC")
+        due = self.state[self.state["next_check"] <= now]
+        urls = due.sort_values("next_check").index
+        return urls if budget is None else urls[:budget]
+
+    def observe(self, url: str, rating: int,
+                now: Optional[pd.Timestamp] = None):
+        """Record a fresh rating of a post and schedule its next check"""
+        now = now or pd.Timestamp.now(tz="UTC")
+        post = self.state.loc[url]
+        delta = rating - post["last_rating"]
+        if delta != 0:
+            self.new_deltas.append((url, now, delta))
+
+        tolerance = max(1, abs(post["last_rating"])
+                        * RatingScheduler.RELATIVE_TOLERANCE)
+        unchanged = post["unchanged_checks"] + 1 if abs(delta) < tolerance \
+            else 0
+        self._schedule(url, post, rating, unchanged, now)
+
+    def observe_failure(self, url: str, now: Optional[pd.Timestamp] = None):
+        """
+        Record a check that gave no rating (a deleted or blocked post, or
+        a network error). It counts as an unchanged check, so such posts
+        back off and get settled instead of staying due forever
+        """
+        now = now or pd.Timestamp.now(tz="UTC")
+        post = self.state.loc[url]
+        self._schedule(url, post, post["last_rating"],
+                       post["unchanged_checks"] + 1, now)
+
+    def _schedule(self, url, post, rating, unchanged, now):
+        interval = RatingScheduler.MIN_INTERVAL * 2 ** unchanged
+        next_check = now + interval
+        if unchanged >= RatingScheduler.SETTLED_CHECKS \
+                or next_check - post["publ_time"] > RatingScheduler.MAX_AGE:
+            next_check = pd.NaT
+
+        self.state.loc[url, ["last_rating", "last_checked", "next_check",
+                             "unchanged_checks"]] = \
+            [rating, now, next_check, unchanged]
+
+    def settled_ratings(self) -> pd.Series:
+        """Final rating of every settled post, indexed by url"""
+        settled = self.state[self.state["next_check"].isna()]
+        return settled["last_rating"].astype(int)
+
+    def unsettled_urls(self) -> pd.Index:
+        """Urls of posts whose ratings are still being re-checked"""
+        return self.state.index[self.state["next_check"].notna()]
+
+    def save(self):
+        self.state.to_csv(self.state_path + ".tmp", encoding="utf-8")
+        os.replace(self.state_path + ".tmp", self.state_path)
+        if self.new_deltas:
+            deltas = pd.DataFrame(self.new_deltas,
+                                  columns=RatingScheduler.DELTA_COLUMNS)
+            deltas.to_csv(self.deltas_path, encoding="utf-8", index=False,
+                          mode="a",
+                          header=not os.path.exists(self.deltas_path))
+            self.new_deltas = []
+
+
+def get_scheduler(interim_dir_path: str) -> RatingScheduler:
+    return RatingScheduler(os.path.join(interim_dir_path, "rating_state.csv"),
+                           os.path.join(interim_dir_path,
+                                        "rating_deltas.csv"))
+
+
+def apply_settled_ratings(df: pd.DataFrame,
+                          scheduler: RatingScheduler) -> pd.DataFrame:
+    """
+    Replace crawl-time ratings with settled re-crawled ones and drop posts
+    whose ratings are still moving, their labels would be too low
+    """
+    df = df[~df["url"].isin(scheduler.unsettled_urls())]
+    df = df.reset_index(drop=True)
+    settled = df["url"].map(scheduler.settled_ratings())
+    df["rating"] = settled.fillna(df["rating"])
+    return df
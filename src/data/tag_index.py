@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+from functools import reduce
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from typing import Iterable, List, Optional
+
+from src.data.tag_rollup import date_from_filename, parse_tags
+
+
+class PostingList():
+    """
+    This class represents a sorted list of post ids of a single tag.
+    Ids are stored as varint encoded gaps, or as a bitmap over all post ids
+    when that is smaller (for very common tags). New ids are always larger
+    than the stored ones, so a day of posts is appended without decoding.
+    """
+
+    def __init__(self):
+        self.kind = "delta"
+        self.data = bytearray()
+        self.last_id = -1
+        self.count = 0
+        self.min_date = None
+        self.max_date = None
+
+    def append(self, ids: Iterable[int], date: str):
+        for post_id in ids:
+            if self.kind == "delta":
+                gap = post_id - self.last_id
+                while gap >= 0x80:
+                    self.data.append(gap & 0x7f | 0x80)
+                    gap >>= 7
+                self.data.append(gap)
+            else:
+                byte = post_id >> 3
+                if byte >= len(self.data):
+                    self.data.extend(bytes(byte - len(self.data) + 1))
+                self.data[byte] |= 0x80 >> (post_id & 7)
+            self.last_id = post_id
+            self.count += 1
+        self.min_date = min(self.min_date or date, date)
+        self.max_date = max(self.max_date or date, date)
+
+    def ids(self) -> np.ndarray:
+        if self.kind == "bitmap":
+            return np.flatnonzero(np.unpackbits(
+                np.frombuffer(bytes(self.data), dtype=np.uint8)))
+        if not self.data:
+            return np.empty(0, dtype=np.int64)
+        data = np.frombuffer(bytes(self.data), dtype=np.uint8).astype(np.int64)
+        is_last = data < 0x80
+        # number of the varint every byte belongs to
+        group = np.concatenate([[0], np.cumsum(is_last)[:-1]])
+        starts = np.concatenate([[0], np.flatnonzero(is_last)[:-1] + 1])
+        shift = 7 * (np.arange(len(data)) - starts[group])
+        gaps = np.zeros(self.count, dtype=np.int64)
+        np.add.at(gaps, group, (data & 0x7f) << shift)
+        return np.cumsum(gaps) - 1
+
+    def compact(self):
+        """Switch to the smaller of the two encodings"""
+        bitmap_size = (self.last_id >> 3) + 1
+        if self.kind == "delta" and bitmap_size < len(self.data):
+            bits = np.zeros(bitmap_size * 8, dtype=np.uint8)
+            bits[self.ids()] = 1
+            self.data = bytearray(np.packbits(bits).tobytes())
+            self.kind = "bitmap"
+        elif self.kind == "bitmap" and self.count * 2 < bitmap_size:
+            ids, min_date, max_date = self.ids(), self.min_date, self.max_date
+            self.__init__()
+            self.append(ids.tolist(), min_date)
+            self.max_date = max_date
+        return self
+
+
+class TagIndex():
+    """
+    This class represents a persistent inverted index from tags to posts.
+    Posts get consecutive integer ids as days are added, every day keeps
+    its id range, so queries can be bounded by publication dates.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.urls = []
+        self.ratings = []
+        self.partitions = {}
+
+    def add_day(self, date, df: pd.DataFrame):
+        """Index posts of a crawled day, days already indexed are skipped"""
+        date = str(date)
+        if date in self.partitions:
+            return
+        start = len(self.urls)
+        ids_by_tag = {}
+        for post_id, row in enumerate(df.itertuples(index=False), start):
+            self.urls.append(row.url)
+            self.ratings.append(row.rating)
+            tags = parse_tags(row.tags) if isinstance(row.tags, str) \
+                else row.tags
+            for tag in set(tags):
+                ids_by_tag.setdefault(tag, []).append(post_id)
+        for tag, ids in ids_by_tag.items():
+            self.postings.setdefault(tag, PostingList()).append(ids, date)
+        self.partitions[date] = (start, len(self.urls))
+
+    def _ids(self, tag: str, start: Optional[str],
+             end: Optional[str]) -> np.ndarray:
+        posting = self.postings.get(tag)
+        if posting is None \
+                or (start is not None and posting.max_date < str(start)) \
+                or (end is not None and posting.min_date >= str(end)):
+            return np.empty(0, dtype=np.int64)
+        return posting.ids()
+
+    def _in_dates(self, ids: np.ndarray, start, end) -> np.ndarray:
+        if start is None and end is None:
+            return ids
+        keep = np.zeros(len(ids), dtype=bool)
+        for date, (lo, hi) in self.partitions.items():
+            if (start is None or date >= str(start)) \
+                    and (end is None or date < str(end)):
+                keep[np.searchsorted(ids, lo):np.searchsorted(ids, hi)] = True
+        return ids[keep]
+
+    def query(self, all_of: List[str] = [], any_of: List[str] = [],
+              start=None, end=None) -> np.ndarray:
+        """
+        Ids of posts published in [start, end) that have all tags of
+        all_of and at least one tag of any_of
+        """
+        lists = []
+        if all_of:
+            lists.append(reduce(
+                lambda a, b: np.intersect1d(a, b, assume_unique=True),
+                (self._ids(tag, start, end) for tag in all_of)))
+        if any_of:
+            lists.append(reduce(np.union1d, (self._ids(tag, start, end)
+                                             for tag in any_of)))
+        if not lists:
+            return np.empty(0, dtype=np.int64)
+        ids = reduce(lambda a, b: np.intersect1d(a, b, assume_unique=True),
+                     lists)
+        return self._in_dates(ids, start, end)
+
+    def posts(self, ids: np.ndarray) -> pd.DataFrame:
+        """url, date and rating of the posts with the given ids"""
+        ids = np.asarray(ids, dtype=np.int64)
+        # partitions are small (one per day), posts are looked up by id
+        bounds = sorted((lo, date) for date, (lo, _) in
+                        self.partitions.items())
+        starts = np.array([lo for lo, _ in bounds], dtype=np.int64)
+        day = np.searchsorted(starts, ids, side="right") - 1
+        return pd.DataFrame({
+            "url": [self.urls[i] for i in ids],
+            "date": [bounds[d][1] for d in day],
+            "rating": np.array([self.ratings[i] for i in ids], dtype=float),
+        })
+
+    def save(self, path: str):
+        for posting in self.postings.values():
+            posting.compact()
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def load(path: str) -> "TagIndex":
+        if not os.path.exists(path):
+            return TagIndex()
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def update_tag_index(raw_dir: str, path: str) -> TagIndex:
+    """Add all raw days that are not indexed yet"""
+    index = TagIndex.load(path)
+    for filename in sorted(os.listdir(raw_dir)):
+        date = date_from_filename(filename)
+        if not filename.endswith(".csv") or date is None \
+                or date in index.partitions:
+            continue
+        df = pd.read_csv(os.path.join(raw_dir, filename),
+                         usecols=["url", "rating", "tags"])
+        index.add_day(date, df)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    index.save(path)
+    return index
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+from collections import Counter
+import os
+import pandas as pd
+from typing import Iterable, List, Optional
+
+
+def parse_tags(tags: str) -> List[str]:
+    """Turn a tags cell of a raw csv (a printed python list) into a list"""
+    if not isinstance(tags, str) or tags == "[]":
+        return []
+    return tags[2:-2].split("', '")
+
+
+def date_from_filename(filename: str) -> Optional[str]:
+    """Return the date of a raw posts_<date>.csv file"""
+    name = os.path.splitext(os.path.basename(filename))[0]
+    if not name.startswith("posts_"):
+        return None
+    return name[len("posts_"):]
+
+
+class TagRollup():
+    """
+    This class represents a daily tag x count table. It is updated once per
+    crawled day, so tag counts for any date window are answered from it
+    without reading raw post files. A day without tags is kept as a single
+    row with an empty tag, so that it is known to be rolled up.
+    """
+
+    COLUMNS = ["date", "tag", "count"]
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.exists(path):
+            self.data = pd.read_csv(path, dtype={"date": str, "tag": str},
+                                    keep_default_na=False)
+        else:
+            self.data = pd.DataFrame(columns=TagRollup.COLUMNS)
+
+    def update_day(self, date, tags: Iterable[List[str]]):
+        """Replace counts of the given day with counts of the given posts"""
+        date = str(date)
+        counts = Counter(tag for post_tags in tags for tag in post_tags)
+        if not counts:
+            counts[""] = 0
+        day = pd.DataFrame({"date": date,
+                            "tag": list(counts.keys()),
+                            "count": list(counts.values())},
+                           columns=TagRollup.COLUMNS)
+        self.data = pd.concat([self.data[self.data["date"] != date], day],
+                              ignore_index=True)
+
+    def save(self):
+        self.data.to_csv(self.path + ".tmp", encoding="utf-8", index=False)
+        os.replace(self.path + ".tmp", self.path)
+
+    def dates(self) -> List[str]:
+        return sorted(self.data["date"].unique())
+
+    def _window(self, start=None, end=None) -> pd.DataFrame:
+        """Rows with dates in [start, end)"""
+        mask = pd.Series(True, index=self.data.index)
+        if start is not None:
+            mask &= self.data["date"] >= str(start)
+        if end is not None:
+            mask &= self.data["date"] < str(end)
+        return self.data[mask]
+
+    def counts(self, start=None, end=None) -> Counter:
+        """Return tag counts of posts published in [start, end)"""
+        window = self._window(start, end)
+        window = window[window["tag"] != ""]
+        return Counter(window.groupby("tag")["count"].sum().to_dict())
+
+    def trend(self, tags: List[str], start=None, end=None) -> pd.DataFrame:
+        """Return a date x tag table of daily counts for the given tags"""
+        window = self._window(start, end)
+        window = window[window["tag"].isin(tags)]
+        trend = window.pivot_table(index="date", columns="tag",
+                                   values="count", aggfunc="sum",
+                                   fill_value=0)
+        return trend.reindex(columns=tags, fill_value=0)
+
+
+def load_rollup(raw_dir: str, path: str) -> TagRollup:
+    """
+    Load the rollup and add all raw days that are not in it yet, so a
+    missing or partial rollup is backfilled from the archive
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rollup = TagRollup(path)
+    known_dates = set(rollup.dates())
+    updated = False
+    for filename in sorted(os.listdir(raw_dir)):
+        date = date_from_filename(filename)
+        if not filename.endswith(".csv") or date is None \
+                or date in known_dates:
+            continue
+        df = pd.read_csv(os.path.join(raw_dir, filename), usecols=["tags"])
+        rollup.update_day(date, df["tags"].apply(parse_tags))
+        updated = True
+    if updated:
+        rollup.save()
+    return rollup
@@ -0,0 +1,152 @@
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from src.data.recrawl import RatingScheduler
+from src.data.tag_rollup import date_from_filename
+
+
+_NS_PER_HOUR = 3600 * 10 ** 9
+
+
+class AuthorIndex:
+    """
+    Per author history of posts built from the local archive. Posts of all
+    authors are kept in one table sorted by author and publication time,
+    so statistics can be taken "as of" any moment using only the posts
+    published strictly before it. Days are added incrementally.
+
+    Ratings change for days after a post is published, so a prior post's
+    rating is only used once it has settled, i.e. the post was published
+    at least RatingScheduler.MAX_AGE before the moment. Post count and the
+    time since the last post use all prior posts.
+    """
+
+    COLUMNS = ["author_name", "time", "url", "rating"]
+
+    def __init__(self):
+        self.posts = pd.DataFrame(columns=AuthorIndex.COLUMNS)
+        self.bounds = {}
+        self.dates = set()
+        self._arrays = None
+
+    def add_partition(self, date, df):
+        df = df[df["author_name"].notna()]
+        new = pd.DataFrame({
+            "author_name": df["author_name"].to_numpy(),
+            "time": pd.to_datetime(df["publ_time"], utc=True).apply(
+                lambda t: t.value).to_numpy(dtype=np.int64),
+            "url": df["url"].to_numpy(),
+            "rating": df["rating"].to_numpy(dtype=np.float64),
+        })
+        posts = pd.concat([self.posts, new], ignore_index=True)
+        self.posts = posts.sort_values(["author_name", "time"],
+                                       kind="stable", ignore_index=True)
+        self.posts["time"] = self.posts["time"].astype(np.int64)
+        self.posts["rating"] = self.posts["rating"].astype(np.float64)
+        authors, starts = np.unique(self.posts["author_name"].to_numpy(),
+                                    return_index=True)
+        stops = np.append(starts[1:], len(self.posts))
+        self.bounds = dict(zip(authors, zip(starts, stops)))
+        self.dates.add(str(date))
+        self._arrays = None
+
+    def set_ratings(self, settled, unsettled):
+        """
+        Replace crawled ratings with the settled ones, and forget ratings
+        of posts that are still being re-checked. Returns True if any
+        rating has changed
+        """
+        ratings = self.posts["url"].map(settled).astype(np.float64)
+        ratings = ratings.where(ratings.notna(), self.posts["rating"])
+        ratings[self.posts["url"].isin(unsettled)] = np.nan
+        if ratings.equals(self.posts["rating"]):
+            return False
+        self.posts["rating"] = ratings
+        self._arrays = None
+        return True
+
+    def _get_arrays(self):
+        if self._arrays is None:
+            ratings = self.posts["rating"].to_numpy(dtype=np.float64)
+            known = ~np.isnan(ratings)
+            self._arrays = (
+                self.posts["time"].to_numpy(dtype=np.int64),
+                ratings,
+                np.concatenate([[0.], np.cumsum(np.where(known, ratings,
+                                                         0.))]),
+                np.concatenate([[0], np.cumsum(known)]),
+            )
+        return self._arrays
+
+    def as_of(self, author, time):
+        """
+        Return (post count, mean rating, median rating, hours since the
+        last post) of the author using posts published before time
+        """
+        if author not in self.bounds:
+            return 0, np.nan, np.nan, np.nan
+        t = pd.Timestamp(time)
+        t = t.tz_localize("UTC") if t.tzinfo is None else t
+        times, ratings, sums, counts = self._get_arrays()
+        lo, hi = self.bounds[author]
+        k = lo + int(np.searchsorted(times[lo:hi], t.value, side="left"))
+        if k == lo:
+            return 0, np.nan, np.nan, np.nan
+        settled = lo + int(np.searchsorted(
+            times[lo:k], (t - RatingScheduler.MAX_AGE).value, side="right"))
+        rated = counts[settled] - counts[lo]
+        if rated:
+            mean = (sums[settled] - sums[lo]) / rated
+            median = np.nanmedian(ratings[lo:settled])
+        else:
+            mean = median = np.nan
+        hours = (t.value - times[k - 1]) / _NS_PER_HOUR
+        return k - lo, mean, median, hours
+
+    def features(self, authors, times):
+        stats = [self.as_of(author, time) if isinstance(author, str)
+                 else (0, np.nan, np.nan, np.nan)
+                 for author, time in zip(authors, times)]
+        return [pd.Series(x) for x in zip(*stats)] if stats \
+            else [pd.Series(dtype=float) for _ in range(4)]
+
+    def save(self, path):
+        self._arrays = None
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def load(path):
+        if not os.path.exists(path):
+            return AuthorIndex()
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def update_author_index(raw_dir, path, scheduler=None):
+    """
+    Add all raw days that are not indexed yet. If a rating scheduler is
+    given, its settled ratings replace the crawled ones
+    """
+    index = AuthorIndex.load(path)
+    changed = False
+    columns = ["author_name", "publ_time", "url", "rating"]
+    for filename in sorted(os.listdir(raw_dir)):
+        date = date_from_filename(filename)
+        if not filename.endswith(".csv") or date is None \
+                or date in index.dates:
+            continue
+        df = pd.read_csv(os.path.join(raw_dir, filename), usecols=columns)
+        index.add_partition(date, df)
+        changed = True
+    if scheduler is not None:
+        changed |= index.set_ratings(scheduler.settled_ratings(),
+                                     scheduler.unsettled_urls())
+    if changed:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        index.save(path)
+    return index
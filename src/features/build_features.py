@@ -1,13 +1,21 @@
+import click
+import json
+import logging
 import os
 import numpy as np
 import pandas as pd
 import re
 
-from collections import Counter
-from dostoevsky.tokenization import RegexTokenizer
-from dostoevsky.models import FastTextSocialNetworkModel
 from dostoevsky.data import DataDownloader, AVAILABLE_FILES
 
+from src.data.recrawl import apply_settled_ratings, get_scheduler
+from src.data.tag_rollup import load_rollup
+from src.features.author_index import update_author_index
+from src.features.feature_store import FeatureStore
+from src.features.near_duplicates import update_repost_index
+from src.features.sentiment import get_backend
+from src.instrumentation import METRICS
+
 
 def download_dostoevsky_data():
     downloader = DataDownloader()
@@ -29,22 +37,52 @@ def get_path(dir):
     return path
 
 
-def open_all_csv(filenames):
+def write_feature_store(features, path):
+    """
+    Rewrite the feature store with one partition per publication day.
+    Tags of every partition are saved next to it, so that tag features
+    can be recomputed for other sets of popular tags
+    """
+    frame = features.features.copy()
+    frame["rate_class"] = features.target
+    frame["rating"] = features.rating
+    store = FeatureStore(path)
+    store.clear()
+    os.makedirs(os.path.join(path, "tags"), exist_ok=True)
+    for day, partition in frame.groupby(features.publ_date, sort=True):
+        store.append_partition(day.isoformat(), partition)
+        tags_path = os.path.join(path, "tags", day.isoformat() + ".json")
+        with open(tags_path, "w", encoding="utf-8") as f:
+            json.dump(list(features.tags.loc[partition.index]), f,
+                      ensure_ascii=False)
+    return store
+
+
+def open_all_csv(path, filenames, sentiment_backends=None):
     dfs = []
     for filename in filenames:
         dfs.append(pd.read_csv(os.path.join(path, filename)))
     df = pd.concat(dfs)
+    METRICS.inc("rows_read", len(df))
     df.reset_index(inplace=True)
     df["publ_time"] = pd.to_datetime(df.publ_time)
+    df = apply_settled_ratings(df,
+                               get_scheduler(get_path(["data", "interim"])))
+    # posts without a rating (e.g. ads) have no target
+    df = df[df["rating"].notna()].reset_index(drop=True)
     df["tags"] = df["tags"].apply(lambda x: x[2:-2].split("', '"))
     df.head()
-    return build_features(df)
+    return build_features(df, sentiment_backends)
     
-def build_features(df):
+def build_features(df, sentiment_backends=None):
     rate_ranges = get_rate_ranges(df)
     popular_tags = get_popular_tags(get_tags())
     features = Features(popular_tags, rate_ranges)
+    features.sentiment_backends.update(sentiment_backends or {})
     features.target, feature = create_features_csv(df, features)
+    features.rating = df["rating"]
+    features.tags = df["tags"]
+    features.publ_date = df["publ_time"].apply(lambda x: x.date())
     for i in feature.keys():
         features.features[i] = pd.Series(feature[i])
     return features
@@ -78,31 +116,32 @@ class Features:
         self.TARGET_VALUE = ['rate_class']
         self.FEATURES_LIST = ["links_count", 'is_long_title', 'title_pos_sent', 'title_neg_sent', 'title_neu_sent', 'text', "popular_tags_count",
                               "tags_count", "pos_tags_count", "neg_tags_count", "is_original",  'image_count', 'publ_hour', 'publ_weekday', 
-                              'video_count', 'text_len', "geo_tags", 'text_pos_sent', 'text_neg_sent', 'text_neu_sent']  
+                              'video_count', 'text_len', "geo_tags", 'text_pos_sent', 'text_neg_sent', 'text_neu_sent',
+                              'is_repost', 'repost_cluster_size',
+                              'author_post_count', 'author_mean_rating',
+                              'author_median_rating',
+                              'author_hours_since_last_post']
                                #idk how to get list of holidays for is_holiday
         self.rate_ranges = rate_ranges
         self.popular_tags = popular_tags
+        # "full" is the dostoevsky model, "fast" the distilled lexicon
+        self.sentiment_backends = {"title": "full", "text": "full",
+                                   "tags": "full"}
         self.target = None
+        self.rating = None
+        self.tags = None
+        self.publ_date = None
         self.features = pd.DataFrame()
 
 
-def get_tags():
-    path = get_path(["data", "raw"])
-    filenames = get_csv_files(path)
-    all_tags = []
-    for filename in filenames:
-        df = pd.read_csv(os.path.join(path, filename))
-        all_tags += collect_all_data(df)
-    tags_and_counts = Counter(all_tags)
-
-    return tags_and_counts
+def get_tags(start=None, end=None):
+    rollup = load_rollup(get_path(["data", "raw"]),
+                         get_path(["data", "interim", "tag_counts.csv"]))
+    return rollup.counts(start, end)
 
 
 def get_popular_tags(tags_and_counts):
-    popular_tags = []
-    for i in range(50):
-        popular_tags.append(tags_and_counts.most_common(50)[i][0])
-    return popular_tags
+    return [tag for tag, _ in tags_and_counts.most_common(50)]
 
 
 def popular_tag_count(tags, popular_tags):
@@ -150,7 +189,7 @@ def is_long_title(x):
     return pd.Series([1 if len(s.split()) > 3 else 0 for s in x])
 
 
-def get_sent(x):
+def get_sent(x, backend="full"):
     def one_hot_encode_sent(x):
         """
         (pos, neg, neu)
@@ -162,17 +201,14 @@ def get_sent(x):
         else:
             return (0, 0, 1)
 
-    tokenizer = RegexTokenizer()
-    model = FastTextSocialNetworkModel(tokenizer=tokenizer)
-    results = model.predict(x, k=1)
-    results = [(list(r.keys())[0], list(r.values())[0]) for r in results]
-    results = list(map(one_hot_encode_sent, results))
+    results = get_backend(backend).predict(x)
+    results = [one_hot_encode_sent((label,)) for label in results]
     results = [results[i] if x[i] != 'EMPTY_TEXT' else (0, 0, 0) for i in range(len(results))]
     return [pd.Series(x) for x in zip(*results)]  # return three series
 
-def sent_all_tags(df):
+def sent_all_tags(df, backend="full"):
     all_tags = list(get_tags())
-    tags_sent = get_sent(all_tags)
+    tags_sent = get_sent(all_tags, backend)
     d = {all_tags[i]:(tags_sent[0][i], tags_sent[1][i]) for i in range(len(all_tags))}
     return d
 
@@ -230,50 +266,109 @@ def create_features_csv(df, features):
     #get_text_length_ranges(df)
 
     x = df['rating']
-    target = pd.Series(transform_rating_to_class(x, features.rate_ranges), name="target!!!")
+    with METRICS.timer("feature_target"):
+        target = pd.Series(transform_rating_to_class(x, features.rate_ranges),
+                           name="rate_class")
 
     feature = {}
 
     x = df['tags']
-    feature["popular_tags_count"] = popular_tag_count(x, features.popular_tags)
+    with METRICS.timer("feature_popular_tags_count"):
+        feature["popular_tags_count"] = popular_tag_count(
+            x, features.popular_tags)
     
     x = df['title']
-    feature['is_long_title'] = is_long_title(x)
-    title_sent = get_sent(x)
+    with METRICS.timer("feature_is_long_title"):
+        feature['is_long_title'] = is_long_title(x)
+    with METRICS.timer("feature_title_sent"):
+        title_sent = get_sent(x, features.sentiment_backends["title"])
     feature['title_pos_sent'], feature['title_neg_sent'], feature['title_neu_sent'] = title_sent
 
     x = df['text'].fillna('EMPTY_TEXT')
-    text_sent = get_sent(x)
+    with METRICS.timer("feature_text_sent"):
+        text_sent = get_sent(x, features.sentiment_backends["text"])
     feature['text_pos_sent'], feature['text_neg_sent'], feature['text_neu_sent'] = text_sent
 
     x = df['text']
-    feature['links_count'] = links_count(x)
+    with METRICS.timer("feature_links_count"):
+        feature['links_count'] = links_count(x)
     
     x = df['tags']
-    tags_sent = sent_all_tags(df)
-    feature['pos_tags_count'], feature['neg_tags_count'] = count_sent_tags(x, tags_sent)
-    geotags = get_geotags()
-    feature['geo_tags'] = check_geo(x, geotags)
-    feature['is_original'] = check_original(x)
+    with METRICS.timer("feature_tags_sent"):
+        tags_sent = sent_all_tags(df, features.sentiment_backends["tags"])
+        feature['pos_tags_count'], feature['neg_tags_count'] = \
+            count_sent_tags(x, tags_sent)
+    with METRICS.timer("feature_geo_tags"):
+        geotags = get_geotags()
+        feature['geo_tags'] = check_geo(x, geotags)
+    with METRICS.timer("feature_is_original"):
+        feature['is_original'] = check_original(x)
     
     
+    with METRICS.timer("feature_reposts"):
+        repost_index = update_repost_index(
+            get_path(["data", "raw"]),
+            get_path(["data", "interim", "repost_index.pkl"]))
+        feature['is_repost'], feature['repost_cluster_size'] = \
+            repost_index.features(df['url'])
+
+    with METRICS.timer("feature_author_stats"):
+        author_index = update_author_index(
+            get_path(["data", "raw"]),
+            get_path(["data", "interim", "author_index.pkl"]),
+            get_scheduler(get_path(["data", "interim"])))
+        (feature['author_post_count'], feature['author_mean_rating'],
+         feature['author_median_rating'],
+         feature['author_hours_since_last_post']) = \
+            author_index.features(df['author_name'], df['publ_time'])
+
     feature['image_count'] = df["image_count"].copy()
     feature['video_count'] = df['video_count'].copy()
 
     x = df["publ_time"]
-    feature["publ_hour"]  = df['publ_time'].apply(lambda x: x.hour)
-    feature["publ_weekday"] = df['publ_time'].apply(lambda x: x.weekday)
+    with METRICS.timer("feature_publ_time"):
+        feature["publ_hour"]  = df['publ_time'].apply(lambda x: x.hour)
+        feature["publ_weekday"] = df['publ_time'].apply(lambda x: x.weekday())
 
    
     #print(feature["popular_tags_count"])
     return target, feature
 
 
-#download_dostoevsky_data()  # comment this if already downloaded
-path = get_path(["data", "raw"])
-f = get_csv_files(path)
-features = open_all_csv(f)
-print([str(key) + " " + str(features.features[key].sum()) for key in features.features.keys() if not features.features[key].empty])
+@click.command()
+@click.option("--profile", is_flag=True,
+              help="Dump cProfile and tracemalloc snapshots per stage")
+@click.option("--title-sentiment", type=click.Choice(["full", "fast"]),
+              default="full")
+@click.option("--text-sentiment", type=click.Choice(["full", "fast"]),
+              default="full")
+@click.option("--tags-sentiment", type=click.Choice(["full", "fast"]),
+              default="full")
+def main(profile, title_sentiment, text_sentiment, tags_sentiment):
+    if profile:
+        METRICS.enable_profiling(
+            get_path(["reports", "profile", "build_features"]))
+
+    #download_dostoevsky_data()  # comment this if already downloaded
+    path = get_path(["data", "raw"])
+    f = get_csv_files(path)
+    with METRICS.stage("build_features"):
+        features = open_all_csv(path, f, {"title": title_sentiment,
+                                          "text": text_sentiment,
+                                          "tags": tags_sentiment})
+    print([str(key) + " " + str(features.features[key].sum()) for key in features.features.keys() if not features.features[key].empty])
+
+    with METRICS.stage("write_store"):
+        write_feature_store(features,
+                            get_path(["data", "interim", "features"]))
+    METRICS.inc("rows_written", len(features.features))
+
+    METRICS.log_summary()
+    METRICS.write_textfile(get_path(["reports", "build_features.prom"]))
+
+
+if __name__ == "__main__":
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
 
-features.features.to_csv(get_path(["data", "interim", "features.csv"]), encoding='utf-8', index=False)
-pd.DataFrame(features.target).to_csv(get_path(["data", "interim", "target.csv"]), encoding='utf-8', index=False)
\ No newline at end of file
+    main()
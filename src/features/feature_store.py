@@ -0,0 +1,153 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# flags are stored as int8, counts as int16, scores as float32
+COLUMN_DTYPES = {
+    "is_long_title": "int8",
+    "title_pos_sent": "int8",
+    "title_neg_sent": "int8",
+    "title_neu_sent": "int8",
+    "text_pos_sent": "int8",
+    "text_neg_sent": "int8",
+    "text_neu_sent": "int8",
+    "geo_tags": "int8",
+    "is_original": "int8",
+    "is_repost": "int8",
+    "publ_hour": "int8",
+    "publ_weekday": "int8",
+    "rate_class": "int8",
+    "links_count": "int16",
+    "popular_tags_count": "int16",
+    "tags_count": "int16",
+    "pos_tags_count": "int16",
+    "neg_tags_count": "int16",
+    "image_count": "int16",
+    "video_count": "int16",
+    "repost_cluster_size": "int16",
+    "rating": "int32",
+    "author_post_count": "int32",
+}
+DEFAULT_DTYPE = "float32"
+
+
+class FeatureStore:
+    """
+    Columnar binary feature store. Every column is a flat typed file that
+    is opened with np.memmap, so readers get the data without parsing.
+    A manifest keeps the schema and the row range of every partition
+    (a day of posts), new partitions are appended to the end of the files.
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        manifest_path = os.path.join(path, FeatureStore.MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        else:
+            manifest = {"columns": {}, "partitions": [], "n_rows": 0}
+        self.columns = manifest["columns"]
+        self.partitions = manifest["partitions"]
+        self.n_rows = manifest["n_rows"]
+
+    def _column_path(self, column):
+        return os.path.join(self.path, column + ".bin")
+
+    def _write_manifest(self):
+        manifest = {"columns": self.columns,
+                    "partitions": self.partitions,
+                    "n_rows": self.n_rows}
+        manifest_path = os.path.join(self.path, FeatureStore.MANIFEST)
+        with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def partition_names(self):
+        return [p["name"] for p in self.partitions]
+
+    def clear(self):
+        for column in self.columns:
+            os.remove(self._column_path(column))
+        self.columns = {}
+        self.partitions = []
+        self.n_rows = 0
+        self._write_manifest()
+
+    def append_partition(self, name, frame):
+        """Append the rows of a DataFrame as a new partition"""
+        name = str(name)
+        if name in self.partition_names():
+            raise ValueError("partition {} already exists".format(name))
+        if self.columns and set(frame.columns) != set(self.columns):
+            raise ValueError("columns of partition {} do not match the "
+                             "schema of the store".format(name))
+        if not self.columns:
+            self.columns = {column: COLUMN_DTYPES.get(column, DEFAULT_DTYPE)
+                            for column in frame.columns}
+        for column, dtype in self.columns.items():
+            if np.issubdtype(np.dtype(dtype), np.integer) \
+                    and frame[column].isna().any():
+                raise ValueError("integer column {} of partition {} has "
+                                 "missing values".format(column, name))
+
+        for column, dtype in self.columns.items():
+            with open(self._column_path(column), "ab") as f:
+                # drop rows left over by an append that failed midway
+                f.truncate(self.n_rows * np.dtype(dtype).itemsize)
+                frame[column].to_numpy().astype(dtype).tofile(f)
+
+        self.partitions.append({"name": name,
+                                "start": self.n_rows,
+                                "stop": self.n_rows + len(frame)})
+        self.n_rows += len(frame)
+        self._write_manifest()
+
+    def column(self, column):
+        """Return a read-only memory-mapped array with the whole column"""
+        if self.n_rows == 0:
+            return np.empty(0, dtype=self.columns[column])
+        return np.memmap(self._column_path(column), mode="r",
+                         dtype=self.columns[column], shape=(self.n_rows,))
+
+    def partition_slices(self, start=None, stop=None):
+        """
+        Return row slices of partitions with names in [start, stop),
+        partitions are named by date so the names compare as dates
+        """
+        slices = []
+        for p in self.partitions:
+            if start is not None and p["name"] < str(start):
+                continue
+            if stop is not None and p["name"] >= str(stop):
+                continue
+            slices.append(slice(p["start"], p["stop"]))
+        return slices
+
+    def read(self, columns=None, start=None, stop=None):
+        """Read the given columns of partitions in [start, stop)"""
+        return self._read_slices(columns, self.partition_slices(start, stop))
+
+    def read_partitions(self, names, columns=None):
+        """Read the given columns of the named partitions, in that order"""
+        ranges = {p["name"]: slice(p["start"], p["stop"])
+                  for p in self.partitions}
+        return self._read_slices(columns, [ranges[str(name)]
+                                           for name in names])
+
+    def _read_slices(self, columns, slices):
+        columns = columns or list(self.columns)
+        data = {}
+        for column in columns:
+            array = self.column(column)
+            if slices:
+                data[column] = np.concatenate([array[s] for s in slices])
+            else:
+                data[column] = np.empty(0, dtype=self.columns[column])
+        return pd.DataFrame(data)
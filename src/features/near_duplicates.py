@@ -0,0 +1,191 @@
+import os
+import pickle
+import re
+import zlib
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from src.data.tag_rollup import date_from_filename
+
+
+SHINGLE_SIZE = 3
+NUM_PERM = 128
+BANDS = 16  # 16 bands x 8 rows, candidates start at jaccard ~0.7
+THRESHOLD = 0.7
+_PRIME = (1 << 31) - 1
+
+
+def shingles(title, text, image_count, video_count):
+    """Word 3-grams of title and text plus image and video counts"""
+    words = re.findall(r"\w+", " ".join(x for x in (title, text)
+                                        if isinstance(x, str)).lower())
+    if len(words) < SHINGLE_SIZE:
+        result = set(words)
+    else:
+        result = {" ".join(words[i:i + SHINGLE_SIZE])
+                  for i in range(len(words) - SHINGLE_SIZE + 1)}
+    result.add("images:{}".format(image_count))
+    result.add("videos:{}".format(video_count))
+    return result
+
+
+class MinHasher:
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, _PRIME, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, _PRIME, size=num_perm).astype(np.uint64)
+
+    def signature(self, shingle_set):
+        x = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingle_set),
+                        dtype=np.uint64, count=len(shingle_set)) % _PRIME
+        hashes = (self.a[:, None] * x[None, :] + self.b[:, None]) % _PRIME
+        return hashes.min(axis=1).astype(np.uint32)
+
+
+class RepostIndex:
+    """
+    Persistent MinHash LSH index over all crawled posts. Posts are added
+    day by day; a post is a repost if an earlier indexed post is a near
+    duplicate of it. Near duplicates are merged into clusters, and
+    is_repost and repost_cluster_size are recorded when a post is added.
+    Days must be added in chronological order (and posts of a day are
+    added by publication time), so the features never depend on posts
+    published later.
+    """
+
+    def __init__(self, num_perm=NUM_PERM, bands=BANDS, threshold=THRESHOLD):
+        assert num_perm % bands == 0
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        # posts get consecutive ids, buckets hold ids, and signatures are
+        # rows of one array that grows by doubling
+        self.buckets = [defaultdict(list) for _ in range(bands)]
+        self.ids = {}
+        self.signatures = np.empty((1024, num_perm), dtype=np.uint32)
+        self.parent = []
+        self.cluster_size = {}
+        self.is_repost = []
+        self.post_cluster_size = []
+        self.dates = set()
+
+    def _find(self, post_id):
+        root = post_id
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[post_id] != root:  # path compression
+            self.parent[post_id], post_id = root, self.parent[post_id]
+        return root
+
+    def _union(self, first, second):
+        first, second = self._find(first), self._find(second)
+        if first == second:
+            return
+        if self.cluster_size[first] < self.cluster_size[second]:
+            first, second = second, first
+        self.parent[second] = first
+        self.cluster_size[first] += self.cluster_size.pop(second)
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:
+                                  (band + 1) * self.rows].tobytes()
+
+    def add(self, url, title, text, image_count, video_count):
+        if url in self.ids:
+            return
+        signature = self.hasher.signature(
+            shingles(title, text, image_count, video_count))
+
+        candidates = set()
+        for band, key in self._band_keys(signature):
+            candidates.update(self.buckets[band].get(key, ()))
+
+        post_id = len(self.parent)
+        self.parent.append(post_id)
+        self.cluster_size[post_id] = 1
+        is_repost = 0
+        if candidates:
+            candidates = np.fromiter(candidates, dtype=np.int64,
+                                     count=len(candidates))
+            similarity = np.mean(self.signatures[candidates] == signature,
+                                 axis=1)
+            for candidate in candidates[similarity >= self.threshold]:
+                self._union(post_id, int(candidate))
+                is_repost = 1
+
+        for band, key in self._band_keys(signature):
+            self.buckets[band][key].append(post_id)
+        if post_id == len(self.signatures):
+            self.signatures = np.concatenate(
+                [self.signatures, np.empty_like(self.signatures)])
+        self.signatures[post_id] = signature
+        self.ids[url] = post_id
+        self.is_repost.append(is_repost)
+        self.post_cluster_size.append(
+            self.cluster_size[self._find(post_id)])
+
+    def add_partition(self, date, df):
+        if self.dates and str(date) < max(self.dates):
+            raise ValueError("day {} is older than the last indexed day, "
+                             "the index has to be rebuilt".format(date))
+        publ_time = pd.to_datetime(df["publ_time"], utc=True)
+        order = np.argsort(publ_time.to_numpy(), kind="stable")
+        for row in df.iloc[order].itertuples(index=False):
+            self.add(row.url, row.title, row.text,
+                     row.image_count, row.video_count)
+        self.dates.add(str(date))
+
+    def features(self, urls):
+        """Return is_repost and repost_cluster_size series for the urls"""
+        ids = [self.ids.get(url) for url in urls]
+        is_repost = pd.Series([0 if i is None else self.is_repost[i]
+                               for i in ids])
+        cluster_size = pd.Series([1 if i is None
+                                  else self.post_cluster_size[i]
+                                  for i in ids])
+        return is_repost, cluster_size
+
+    def save(self, path):
+        # keep at least one row, so the array can still grow by doubling
+        self.signatures = self.signatures[:max(len(self.parent), 1)].copy()
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def load(path):
+        if not os.path.exists(path):
+            return RepostIndex()
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def update_repost_index(raw_dir, path):
+    """
+    Add all raw days that are not indexed yet, in chronological order.
+    If a backfilled day is older than the last indexed one, the index is
+    rebuilt from scratch, since posts of that day came before later ones
+    """
+    index = RepostIndex.load(path)
+    columns = ["url", "title", "text", "image_count", "video_count",
+               "publ_time"]
+    days = {}
+    for filename in os.listdir(raw_dir):
+        date = date_from_filename(filename)
+        if filename.endswith(".csv") and date is not None:
+            days[date] = filename
+    missing = sorted(set(days) - index.dates)
+    if missing and index.dates and missing[0] < max(index.dates):
+        index = RepostIndex()
+        missing = sorted(days)
+    for date in missing:
+        df = pd.read_csv(os.path.join(raw_dir, days[date]), usecols=columns)
+        index.add_partition(date, df)
+    if missing:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        index.save(path)
+    return index
@@ -0,0 +1,178 @@
+import click
+import logging
+import os
+import time
+import zlib
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from dostoevsky.tokenization import RegexTokenizer
+from dostoevsky.models import FastTextSocialNetworkModel
+
+from src.features.text_features import HashingTextVectorizer
+
+
+class SentimentBackend:
+    """Turns a list of texts into a list of sentiment labels"""
+
+    def predict(self, texts):
+        raise NotImplementedError
+
+
+class DostoevskyBackend(SentimentBackend):
+    """The full fastText model of dostoevsky, loaded once per process"""
+
+    _model = None
+
+    def predict(self, texts):
+        if DostoevskyBackend._model is None:
+            DostoevskyBackend._model = FastTextSocialNetworkModel(
+                tokenizer=RegexTokenizer())
+        results = DostoevskyBackend._model.predict(list(texts), k=1)
+        return [list(r.keys())[0] for r in results]
+
+
+class LexiconBackend(SentimentBackend):
+    """
+    Multinomial naive Bayes over hashed unigrams, i.e. a per token weight
+    lexicon with a linear scorer. It is distilled from the labels of the
+    full model and scores a whole batch with one sparse matrix product.
+    """
+
+    def __init__(self, n_features=2 ** 18):
+        # naive Bayes needs token counts, not signed hashes
+        self.vectorizer = HashingTextVectorizer(n_features, ngram_range=(1, 1),
+                                                alternate_sign=False)
+        self.labels = None
+        self.weights = None
+        self.bias = None
+
+    def fit(self, texts, labels, alpha=1.0):
+        labels = np.asarray(labels)
+        self.labels = np.unique(labels)
+        X = self.vectorizer.transform(texts)
+        Y = (labels[:, None] == self.labels[None, :]).astype(np.float32)
+        token_counts = np.asarray((X.T @ Y)) + alpha
+        self.weights = np.log(token_counts / token_counts.sum(axis=0))
+        self.bias = np.log(Y.sum(axis=0) / len(labels))
+        return self
+
+    def predict(self, texts):
+        scores = self.vectorizer.transform(texts) @ self.weights \
+            + self.bias
+        return list(self.labels[np.asarray(scores).argmax(axis=1)])
+
+    def save(self, path):
+        np.savez(path, labels=self.labels, weights=self.weights,
+                 bias=self.bias, n_features=self.vectorizer.n_features)
+
+    @staticmethod
+    def load(path):
+        data = np.load(path)
+        backend = LexiconBackend(int(data["n_features"]))
+        backend.labels = data["labels"]
+        backend.weights = data["weights"]
+        backend.bias = data["bias"]
+        return backend
+
+
+LEXICON_PATH = os.path.join("models", "sentiment_lexicon.npz")
+
+
+@lru_cache(maxsize=None)
+def get_backend(name):
+    """
+    Return a backend by mode name: "full" (default) or "fast". Backends
+    are created once per process
+    """
+    if name == "fast":
+        if not os.path.exists(LEXICON_PATH):
+            raise FileNotFoundError(
+                "{} not found, run `python src/features/sentiment.py train "
+                "data/raw` first to use the fast sentiment backend".format(
+                    LEXICON_PATH))
+        return LexiconBackend.load(LEXICON_PATH)
+    if name == "full":
+        return DostoevskyBackend()
+    raise ValueError("unknown sentiment backend: {}".format(name))
+
+
+def benchmark(texts, fast, full):
+    """Throughput of both backends and the share of equal labels"""
+    texts = list(texts)
+    # load models before timing, so that load time is not counted
+    full.predict(texts[:1])
+    fast.predict(texts[:1])
+    start = time.perf_counter()
+    full_labels = full.predict(texts)
+    full_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    fast_labels = fast.predict(texts)
+    fast_seconds = time.perf_counter() - start
+    return {
+        "texts": len(texts),
+        "full_texts_per_sec": len(texts) / full_seconds,
+        "fast_texts_per_sec": len(texts) / fast_seconds,
+        "agreement": float(np.mean(np.array(full_labels)
+                                   == np.array(fast_labels))),
+    }
+
+
+def read_texts(raw_dir):
+    texts = []
+    for filename in sorted(os.listdir(raw_dir)):
+        if filename.endswith(".csv"):
+            df = pd.read_csv(os.path.join(raw_dir, filename),
+                             usecols=["title", "text"])
+            texts += list(df["title"].dropna()) + list(df["text"].dropna())
+    return texts
+
+
+def split_texts(texts, holdout):
+    """
+    Split texts into a training and a held-out part. Texts are assigned
+    by their hash, so the split stays the same as the archive grows
+    """
+    train, test = [], []
+    for text in texts:
+        h = zlib.crc32(text.encode("utf-8")) % 1000
+        (test if h < holdout * 1000 else train).append(text)
+    return train, test
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument("raw_dir", type=click.Path(exists=True))
+@click.option("--holdout", default=0.2, show_default=True,
+              help="Share of texts kept out of training for benchmark")
+def train(raw_dir, holdout):
+    """Distill the fast backend from labels of the full model"""
+    texts, _ = split_texts(read_texts(raw_dir), holdout)
+    labels = DostoevskyBackend().predict(texts)
+    LexiconBackend().fit(texts, labels).save(LEXICON_PATH)
+
+
+@cli.command("benchmark")
+@click.argument("raw_dir", type=click.Path(exists=True))
+@click.option("--holdout", default=0.2, show_default=True,
+              help="Must match the share used by train")
+def benchmark_command(raw_dir, holdout):
+    """Compare the fast backend to the full model on held-out texts"""
+    _, texts = split_texts(read_texts(raw_dir), holdout)
+    result = benchmark(texts, get_backend("fast"), get_backend("full"))
+    logging.getLogger(__name__).info(
+        "%(texts)d texts, full: %(full_texts_per_sec).0f texts/sec, "
+        "fast: %(fast_texts_per_sec).0f texts/sec, "
+        "agreement: %(agreement).3f", result)
+
+
+if __name__ == "__main__":
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    cli()
@@ -0,0 +1,150 @@
+import click
+import json
+import logging
+import os
+import zlib
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from dostoevsky.tokenization import RegexTokenizer
+
+from src.instrumentation import METRICS, Metrics
+
+
+class HashingTextVectorizer:
+    """
+    Stateless bag of n-grams vectorizer. Every n-gram is mapped to a column
+    with the hashing trick, so no vocabulary has to be fitted or kept in
+    memory, and any chunk of posts can be vectorized independently.
+    With alternate_sign, the sign of every n-gram is taken from its hash,
+    so that collisions cancel out on average; without it, plain counts are
+    returned.
+    """
+
+    def __init__(self, n_features=2 ** 18, ngram_range=(1, 2),
+                 alternate_sign=True):
+        self.n_features = n_features
+        self.ngram_range = ngram_range
+        self.alternate_sign = alternate_sign
+        self.tokenizer = RegexTokenizer()
+
+    def tokenize(self, text):
+        if not isinstance(text, str):
+            return []
+        return [token for token, _ in self.tokenizer.split(text)]
+
+    def ngrams(self, tokens):
+        min_n, max_n = self.ngram_range
+        for n in range(min_n, max_n + 1):
+            for i in range(len(tokens) - n + 1):
+                yield " ".join(tokens[i:i + n])
+
+    def transform(self, texts):
+        """Return a CSR matrix of hashed n-gram counts"""
+        indptr = [0]
+        indices = []
+        values = []
+        for text in texts:
+            for ngram in self.ngrams(self.tokenize(text)):
+                # crc32 instead of hash(), which is salted per process
+                h = zlib.crc32(ngram.encode("utf-8"))
+                indices.append(h % self.n_features)
+                values.append(1 if h & 0x80000000 or
+                              not self.alternate_sign else -1)
+            indptr.append(len(indices))
+
+        X = sp.csr_matrix((np.array(values, dtype=np.float32),
+                           np.array(indices, dtype=np.int32),
+                           np.array(indptr, dtype=np.int64)),
+                          shape=(len(indptr) - 1, self.n_features))
+        X.sum_duplicates()
+        return X
+
+
+TEXT_COLUMNS = ["title", "text"]
+
+
+def vectorize_partition(input_path, output_dir, n_features=2 ** 18,
+                        chunksize=10000):
+    """
+    Vectorize titles and texts of one raw posts file chunk by chunk and
+    save one sparse matrix per column to output_dir, together with the
+    urls of the rows, so the matrices can be joined with other features.
+    Runs in a worker process, so its metrics are returned to the parent
+    """
+    metrics = Metrics()
+    vectorizer = HashingTextVectorizer(n_features)
+    partition = os.path.splitext(os.path.basename(input_path))[0]
+    chunks = {column: [] for column in TEXT_COLUMNS}
+    urls = []
+
+    for df in pd.read_csv(input_path, usecols=["url"] + TEXT_COLUMNS,
+                          chunksize=chunksize):
+        urls.extend(df["url"])
+        for column in TEXT_COLUMNS:
+            with metrics.timer("feature_hashed_" + column):
+                chunks[column].append(vectorizer.transform(df[column]))
+
+    for column in TEXT_COLUMNS:
+        X = sp.vstack(chunks[column], format="csr") if chunks[column] \
+            else sp.csr_matrix((0, n_features), dtype=np.float32)
+        sp.save_npz(os.path.join(output_dir,
+                                 "{}_{}.npz".format(column, partition)), X)
+    with open(os.path.join(output_dir, "url_{}.json".format(partition)), "w",
+              encoding="utf-8") as f:
+        json.dump(urls, f, ensure_ascii=False)
+    metrics.inc("rows_written", len(urls))
+    return partition, metrics
+
+
+def load_partition(output_dir, column, partition):
+    return sp.load_npz(os.path.join(output_dir,
+                                    "{}_{}.npz".format(column, partition)))
+
+
+def load_urls(output_dir, partition):
+    """Urls of the rows of the partition matrices, in the same order"""
+    with open(os.path.join(output_dir, "url_{}.json".format(partition)),
+              encoding="utf-8") as f:
+        return json.load(f)
+
+
+def vectorize_all(input_dir, output_dir, n_features=2 ** 18, processes=None):
+    """Vectorize every raw posts file in parallel, one process per file"""
+    os.makedirs(output_dir, exist_ok=True)
+    filenames = sorted(f for f in os.listdir(input_dir) if f.endswith(".csv"))
+    args = [(os.path.join(input_dir, f), output_dir, n_features)
+            for f in filenames]
+    with Pool(processes) as pool:
+        results = pool.starmap(vectorize_partition, args)
+    for _, metrics in results:
+        METRICS.merge(metrics)
+    return [partition for partition, _ in results]
+
+
+@click.command()
+@click.argument("input_dir", type=click.Path(exists=True))
+@click.argument("output_dir", type=click.Path())
+@click.option("--n-features", default=2 ** 18, show_default=True)
+@click.option("--processes", default=None, type=int)
+def main(input_dir, output_dir, n_features, processes):
+    """Turn titles and texts from raw posts into hashed n-gram matrices"""
+    with METRICS.stage("text_features"):
+        partitions = vectorize_all(input_dir, output_dir, n_features,
+                                   processes)
+    logging.getLogger(__name__).info("vectorized %d partitions",
+                                     len(partitions))
+
+    reports_dir = Path(__file__).resolve().parents[2] / "reports"
+    METRICS.log_summary()
+    METRICS.write_textfile(str(reports_dir / "text_features.prom"))
+
+
+if __name__ == "__main__":
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
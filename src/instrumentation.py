@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import cProfile
+from collections import defaultdict
+from contextlib import contextmanager
+import logging
+import os
+import re
+import time
+import tracemalloc
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics():
+    """
+    This class collects counters and timers of the crawl and feature
+    pipelines. Metrics are emitted as structured log lines and as a
+    Prometheus textfile. If profiling is enabled, every stage also dumps
+    a cProfile file and a tracemalloc snapshot.
+    """
+
+    PREFIX = "pikabu_"
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        self.timer_sums = defaultdict(float)
+        self.timer_counts = defaultdict(int)
+        self.stage_counts = defaultdict(int)
+        self.profile_dir = None
+
+    def enable_profiling(self, profile_dir: str):
+        os.makedirs(profile_dir, exist_ok=True)
+        self.profile_dir = profile_dir
+
+    def inc(self, name: str, value: float = 1):
+        self.counters[name] += value
+
+    def observe(self, name: str, seconds: float):
+        self.timer_sums[name] += seconds
+        self.timer_counts[name] += 1
+
+    @contextmanager
+    def timer(self, name: str):
+        """Add the time spent in the block to the timer with the given name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    @contextmanager
+    def stage(self, name: str, suffix: Optional[str] = None):
+        """
+        Time a whole pipeline stage, log its duration and, if profiling
+        is enabled, dump profiles of the stage to the profile directory.
+        Profile files are named <stage>_<suffix>, or <stage>_<n> for the
+        n-th run of the stage, so that repeated stages keep their profiles
+        """
+        self.stage_counts[name] += 1
+        label = "{}_{}".format(name, suffix if suffix is not None
+                               else self.stage_counts[name])
+        profiler = None
+        if self.profile_dir:
+            profiler = cProfile.Profile()
+            tracemalloc.start()
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            with self.timer("stage_" + name):
+                yield
+        finally:
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(
+                    os.path.join(self.profile_dir, label + ".prof"))
+                tracemalloc.take_snapshot().dump(
+                    os.path.join(self.profile_dir, label + ".tracemalloc"))
+                tracemalloc.stop()
+            log_event("stage_finished", stage=name,
+                      seconds=round(time.perf_counter() - start, 3))
+
+    def rate(self, counter: str, timer: str) -> Optional[float]:
+        """Return counter value per second spent in timer"""
+        seconds = self.timer_sums.get(timer)
+        if not seconds:
+            return None
+        return self.counters.get(counter, 0) / seconds
+
+    def log_summary(self):
+        for name, value in sorted(self.counters.items()):
+            log_event("counter", name=name, value=value)
+        for name, seconds in sorted(self.timer_sums.items()):
+            log_event("timer", name=name, seconds=round(seconds, 3),
+                      count=self.timer_counts[name])
+
+    def to_prometheus(self) -> str:
+        lines = []
+        for name, value in sorted(self.counters.items()):
+            metric = Metrics.PREFIX + _metric_name(name) + "_total"
+            lines.append("# TYPE {} counter".format(metric))
+            lines.append("{} {}".format(metric, value))
+        for name, seconds in sorted(self.timer_sums.items()):
+            metric = Metrics.PREFIX + _metric_name(name) + "_seconds"
+            lines.append("# TYPE {} summary".format(metric))
+            lines.append("{}_sum {}".format(metric, seconds))
+            lines.append("{}_count {}".format(metric,
+                                              self.timer_counts[name]))
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        """
+        Write metrics in the Prometheus textfile format. The file is
+        written to a temporary path first, so that a collector never
+        reads a half-written file
+        """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def merge(self, other: "Metrics"):
+        """Add metrics collected elsewhere, e.g. in a worker process"""
+        for name, value in other.counters.items():
+            self.counters[name] += value
+        for name, seconds in other.timer_sums.items():
+            self.timer_sums[name] += seconds
+            self.timer_counts[name] += other.timer_counts[name]
+
+    def reset(self):
+        self.counters.clear()
+        self.timer_sums.clear()
+        self.timer_counts.clear()
+        self.stage_counts.clear()
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def log_event(event: str, **fields):
+    """Log an event as a single line of key=value pairs"""
+    pairs = " ".join("{}={}".format(key, value)
+                     for key, value in fields.items())
+    logger.info("event=%s %s", event, pairs)
+
+
+METRICS = Metrics()
@@ -0,0 +1,151 @@
+import click
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import HistGradientBoostingClassifier
+
+from src.data.tag_rollup import TagRollup
+from src.features.build_features import (get_path, get_popular_tags,
+                                         get_rate_ranges)
+from src.features.feature_store import FeatureStore
+
+
+# columns that depend on the whole data set and are recomputed per fold
+FOLD_COLUMNS = ["rate_class", "rating", "popular_tags_count"]
+
+
+def make_folds(partitions, train_days, test_days=1, step=1):
+    """
+    Walk-forward folds over sorted date partitions: every fold trains on
+    train_days partitions and tests on the test_days ones right after them
+    """
+    partitions = sorted(partitions)
+    folds = []
+    for start in range(0, len(partitions) - train_days - test_days + 1, step):
+        train = partitions[start:start + train_days]
+        test = partitions[start + train_days:start + train_days + test_days]
+        folds.append((train, test))
+    return folds
+
+
+@lru_cache(maxsize=None)
+def open_store(store_path):
+    return FeatureStore(store_path)
+
+
+@lru_cache(maxsize=None)
+def open_rollup(rollup_path):
+    return TagRollup(rollup_path)
+
+
+@lru_cache(maxsize=1024)
+def load_tags(store_path, partition):
+    path = os.path.join(store_path, "tags", partition + ".json")
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_partitions(store_path, partitions):
+    """
+    Read fold independent features of the partitions from the memory
+    mapped store, the rows are not recomputed for every fold
+    """
+    frame = open_store(store_path).read_partitions(partitions)
+    tags = [t for p in partitions for t in load_tags(store_path, p)]
+    return frame, tags
+
+
+def rate_classes(rating, rate_ranges):
+    """Vectorized transform_rating_to_class"""
+    bounds = [rate_ranges[i][1] for i in range(len(rate_ranges))]
+    return np.searchsorted(bounds, rating, side="left")
+
+
+def popular_tags_count(tags, popular_tags):
+    popular_tags = set(popular_tags)
+    return np.array([sum(tag in popular_tags for tag in post_tags)
+                     for post_tags in tags])
+
+
+def prepare(frame, tags, rate_ranges, popular_tags):
+    X = frame.drop(columns=FOLD_COLUMNS).astype(np.float32)
+    X["popular_tags_count"] = popular_tags_count(tags, popular_tags)
+    y = rate_classes(frame["rating"].to_numpy(), rate_ranges)
+    return X, y
+
+
+def run_fold(store_path, rollup_path, train, test):
+    """
+    Fit on the train partitions and score on the test ones. Rate ranges
+    and popular tags are taken from the training window only
+    """
+    train_frame, train_tags = read_partitions(store_path, train)
+    test_frame, test_tags = read_partitions(store_path, test)
+
+    rate_ranges = get_rate_ranges(train_frame[["rating"]])
+    # rollup windows are [start, end), so the test days are excluded
+    tag_counts = open_rollup(rollup_path).counts(train[0], test[0])
+    popular_tags = get_popular_tags(tag_counts)
+
+    X_train, y_train = prepare(train_frame, train_tags, rate_ranges,
+                               popular_tags)
+    X_test, y_test = prepare(test_frame, test_tags, rate_ranges,
+                             popular_tags)
+
+    model = HistGradientBoostingClassifier()
+    model.fit(X_train, y_train)
+    predicted = model.predict(X_test)
+
+    return {
+        "train_start": train[0],
+        "train_end": train[-1],
+        "test_start": test[0],
+        "test_end": test[-1],
+        "train_rows": len(y_train),
+        "test_rows": len(y_test),
+        "accuracy": float(np.mean(predicted == y_test)),
+        "mean_class_error": float(np.mean(np.abs(predicted - y_test))),
+    }
+
+
+def backtest(store_path, rollup_path, train_days, test_days=1, step=1,
+             processes=None):
+    folds = make_folds(open_store(store_path).partition_names(),
+                       train_days, test_days, step)
+    with ProcessPoolExecutor(processes) as executor:
+        results = executor.map(run_fold,
+                               [store_path] * len(folds),
+                               [rollup_path] * len(folds),
+                               [train for train, _ in folds],
+                               [test for _, test in folds])
+        return pd.DataFrame(list(results))
+
+
+@click.command()
+@click.option("--train-days", default=30, show_default=True)
+@click.option("--test-days", default=1, show_default=True)
+@click.option("--step", default=1, show_default=True)
+@click.option("--processes", default=None, type=int)
+def main(train_days, test_days, step, processes):
+    """Walk-forward backtest over the daily partitions of the feature store"""
+    results = backtest(get_path(["data", "interim", "features"]),
+                       get_path(["data", "interim", "tag_counts.csv"]),
+                       train_days, test_days, step, processes)
+    results.to_csv(get_path(["reports", "backtest.csv"]), encoding='utf-8',
+                   index=False)
+    mean_accuracy = results["accuracy"].mean() if len(results) \
+        else float("nan")
+    logging.getLogger(__name__).info("%d folds, mean accuracy %.3f",
+                                     len(results), mean_accuracy)
+
+
+if __name__ == "__main__":
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
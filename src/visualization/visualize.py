@@ -1,25 +1,12 @@
-import pandas as pd
 import os
 import matplotlib.pyplot as plt
 from wordcloud import WordCloud
 from pathlib import Path
 import numpy as np
 from PIL import Image
-from collections import Counter
 from wordcloud import ImageColorGenerator
 
-def collect_all_data(df):
-    df.reset_index(inplace=True)
-    df.head()
-    all_tags = []
-    for i in df.tags:
-        all_tags += i[2:-2].split("', '")
-    return all_tags
-
-def get_csv_files(path):
-    _, _, filenames = next(os.walk(path))
-    filenames = filter(lambda x : x.endswith('.csv'), filenames)
-    return filenames
+from src.data.tag_rollup import load_rollup
 
 def get_path(dir):
     project_dir = os.path.abspath('')
@@ -27,20 +14,26 @@ def get_path(dir):
     path = os.path.join(project_dir , image_dir)
     return path
 
-def get_tags():
-    path = get_path(["data", "raw"])
-    filenames = get_csv_files(path)
-    all_tags = []
-    for filename in filenames:
-        df = pd.read_csv(os.path.join(path, filename))
-        all_tags += collect_all_data(df)
-    tags_and_counts = Counter(all_tags)
-    popular_tags = []
-    for i in range(50):
-        popular_tags.append(tags_and_counts.most_common(50)[i][0])
+def get_rollup():
+    return load_rollup(get_path(["data", "raw"]),
+                       get_path(["data", "interim", "tag_counts.csv"]))
+
+def get_tags(start=None, end=None):
+    """Tag counts of posts published in [start, end), from the daily rollup"""
+    tags_and_counts = get_rollup().counts(start, end)
+    popular_tags = [tag for tag, _ in tags_and_counts.most_common(50)]
     print(popular_tags)
     return tags_and_counts
 
+def plot_tag_trend(tags, start=None, end=None):
+    trend = get_rollup().trend(tags, start, end)
+    trend.plot(figsize=(12, 6))
+    plt.xlabel("date")
+    plt.ylabel("posts")
+    plt.tight_layout()
+    plt.savefig("tag_trend.jpg")
+    plt.show()
+
 def create_wordcloud(tags_and_counts):
     path = get_path(["notebooks", "picabu_ru.jpg"])
     mask = np.array(Image.open(path))